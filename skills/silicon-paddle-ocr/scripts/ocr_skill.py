@@ -4,114 +4,246 @@
 OCR Skill - 使用 PaddleOCR 识别图片中的文字
 """
 
+import argparse
 import base64
+import functools
+import glob
+import importlib.util
+import io
 import json
+import os
 import re
+import struct
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
 try:
-    from openai import OpenAI
+    import numpy as np
+except ImportError:
+    print("错误: 需要安装 numpy 库")
+    print("运行: pip install numpy")
+    sys.exit(1)
+
+try:
+    import orjson
+except ImportError:
+    # orjson 为可选依赖，未安装时使用标准库 json
+    orjson = None
+
+try:
+    from openai import DefaultHttpxClient, OpenAI
 except ImportError:
     print("错误: 需要安装 openai 库")
     print("运行: pip install openai")
     sys.exit(1)
 
 
-def image_to_base64(image_path: str) -> str:
-    """将图片文件转换为 base64 字符串"""
+# 文本片段与其后紧跟的一串 <|LOC_xxx|> 标记
+# (正则比 str.find 手写扫描更快)
+_PAIR_RE = re.compile(r'([^\|<]+?)((?:<\|LOC_\d+\|\>)+)')
+# 单个 LOC 标记中的数值
+_LOC_RE = re.compile(r'LOC_(\d+)')
+
+# 文件扩展名到 MIME 类型的映射
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+}
+
+# JPEG 中带有宽高信息的 SOF 段标记 (排除 DHT / JPG / DAC)
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# httpx 的 HTTP/2 支持需要额外安装 h2 (pip install httpx[http2])
+_HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# 硅基流动平台 API 地址
+_BASE_URL = "https://api.siliconflow.cn/v1"
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str, base_url: str) -> OpenAI:
+    """
+    获取 OpenAI 客户端，相同配置复用同一个客户端及其连接池
+
+    安装了 h2 时启用 HTTP/2，批量请求同一主机可在一个连接上多路复用；
+    超时和连接池沿用 openai 库的默认值
+    """
+    http_client = DefaultHttpxClient(http2=_HTTP2_AVAILABLE)
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
+
+def _fast_image_size_from_bytes(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    直接从文件头解析图片尺寸，无需 PIL
+
+    支持 PNG / GIF / BMP / WebP / JPEG，无法识别或数据不完整时返回 None
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+
+    if data[:2] == b"BM" and len(data) >= 26:
+        (header_size,) = struct.unpack("<I", data[14:18])
+        if header_size == 12:
+            # OS/2 BITMAPCOREHEADER: 16 位无符号宽高
+            return struct.unpack("<HH", data[18:22])
+        width, height = struct.unpack("<ii", data[18:26])
+        # 高度为负表示自上而下存储
+        return width, abs(height)
+
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP" and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b"VP8 " and data[23:26] == b"\x9d\x01\x2a":
+            width, height = struct.unpack("<HH", data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b"VP8L" and data[20] == 0x2F:
+            (bits,) = struct.unpack("<I", data[21:25])
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            width = int.from_bytes(data[24:27], "little") + 1
+            height = int.from_bytes(data[27:30], "little") + 1
+            return width, height
+        return None
+
+    if data[:2] == b"\xff\xd8":
+        # 依次跳过 JPEG 段，直到 SOF 段读取宽高
+        i = 2
+        while i + 9 <= len(data):
+            if data[i] != 0xFF:
+                return None
+            marker = data[i + 1]
+            if marker == 0xFF:
+                # 填充字节
+                i += 1
+            elif marker in _JPEG_SOF_MARKERS:
+                height, width = struct.unpack(">HH", data[i + 5:i + 9])
+                return width, height
+            elif marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                # 无长度字段的独立标记
+                i += 2
+            else:
+                (length,) = struct.unpack(">H", data[i + 2:i + 4])
+                i += 2 + length
+        return None
+
+    return None
+
+
+def _load_image(image_path: str) -> Tuple[bytes, Tuple[int, int]]:
+    """读取图片文件一次，同时返回原始字节和图片尺寸（优先从文件头解析，无法识别时使用 PIL）"""
     with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+        data = f.read()
 
+    size = _fast_image_size_from_bytes(data)
+    if size is None:
+        # 仅在无法解析文件头时才需要 PIL，按需导入以免每次启动都加载
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as img:
+            size = img.size
+    return data, size
 
-def get_image_size(image_path: str) -> Tuple[int, int]:
-    """获取图片尺寸"""
-    from PIL import Image
-    with Image.open(image_path) as img:
-        return img.size
+
+def _build_data_url(raw: bytes, mime_type: str) -> str:
+    """将图片字节直接编码为 data URL，避免中间字符串拼接产生的额外拷贝"""
+    buf = bytearray(b"data:")
+    buf += mime_type.encode("ascii")
+    buf += b";base64,"
+    buf += base64.b64encode(raw)
+    return buf.decode("ascii")
 
 
 def get_mime_type(image_path: str) -> str:
     """根据文件扩展名获取 MIME 类型"""
-    ext = Path(image_path).suffix.lower()
-    mime_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".webp": "image/webp",
-        ".bmp": "image/bmp",
-        ".gif": "image/gif",
-    }
-    return mime_types.get(ext, "image/jpeg")
+    ext = os.path.splitext(image_path)[1].lower()
+    return _MIME_TYPES.get(ext, "image/jpeg")
 
 
-def parse_loc_tags(content: str, image_size: Tuple[int, int]) -> List[Dict[str, Any]]:
+def _scale_boxes(coords: "np.ndarray", x_scale: float, y_scale: float) -> "np.ndarray":
+    """
+    将 (N, 8) 的 LOC 坐标数组缩放为 (N, 4, 2) 的像素坐标数组
+    """
+    # 每个点的 (x, y) 分别乘以 (x_scale, y_scale)
+    scale = np.array([x_scale, y_scale], dtype=np.float64)
+    return (coords.reshape(-1, 4, 2) * scale).astype(np.int32)
+
+
+def parse_loc_tags(
+    content: str,
+    image_size: Tuple[int, int],
+    loc_max: Optional[int] = None
+) -> Tuple[List[str], "np.ndarray"]:
     """
     解析 PaddleOCR-VL 模型返回的 <|LOC_xxx|> 标记
-    返回带真实像素坐标的文字列表
+    返回 (文字列表, 像素坐标数组)，坐标数组形状为 (N, 4, 2)，第 i 行是第 i 段文字的四个角点
 
     格式: 文本<|LOC_x1|><|LOC_y1|><|LOC_x2|><|LOC_y2|><|LOC_x3|><|LOC_y3|><|LOC_x4|><|LOC_y4|>文本...
 
     坐标转换: LOC 是归一化值，需要乘以缩放系数得到真实像素坐标
+
+    loc_max: 已知的 LOC 归一化最大值（如 972）；为 None 时使用响应中出现的最大 LOC 值
     """
     img_width, img_height = image_size
 
-    text_coord_pairs = re.findall(r'([^\|<]+?)((?:<\|LOC_\d+\|\>)+)', content)
-
-    # 先扫描所有 LOC 值，找到最大值用于计算缩放系数
-    all_loc_values = []
-    for _, loc_tags in text_coord_pairs:
-        coords = [int(c) for c in re.findall(r'LOC_(\d+)', loc_tags)]
-        all_loc_values.extend(coords)
+    # 单次扫描: 收集 (文本, LOC 数值)，未指定 loc_max 时同时记录 LOC 最大值
+    text_coord_pairs = []
+    max_loc = loc_max
+    for match in _PAIR_RE.finditer(content):
+        coords = list(map(int, _LOC_RE.findall(match.group(2))))
+        if loc_max is None and coords:
+            local_max = max(coords)
+            if max_loc is None or local_max > max_loc:
+                max_loc = local_max
+        text_coord_pairs.append((match.group(1).strip(), coords))
 
-    max_loc = max(all_loc_values) if all_loc_values else 972
+    if max_loc is None:
+        max_loc = 972
 
     # 计算缩放系数
     x_scale = img_width / max_loc if max_loc > 0 else 1
     y_scale = img_height / max_loc if max_loc > 0 else 1
 
     texts = []
+    # 按坐标数量分组收集，之后统一做向量化缩放
+    quad_indices, quad_coords = [], []
+    rect_indices, rect_coords = [], []
 
-    for text_chunk, loc_tags in text_coord_pairs:
-        text = text_chunk.strip()
+    for text, coords in text_coord_pairs:
         if not text:
             continue
 
-        # 提取 LOC 数值
-        coord_matches = re.findall(r'LOC_(\d+)', loc_tags)
-        coords = [int(c) for c in coord_matches]
-
-        # 转换为真实像素坐标
         if len(coords) >= 8:
             # 4个点(每个点2个坐标): x1,y1,x2,y2,x3,y3,x4,y4
-            box = []
-            for i in range(0, 8, 2):
-                x = int(coords[i] * x_scale)
-                y = int(coords[i+1] * y_scale)
-                box.append([x, y])
+            quad_indices.append(len(texts))
+            quad_coords.append(coords[:8])
         elif len(coords) >= 4:
             # 4个值: x1,y1,x2,y2 (边界框)
-            x1 = int(coords[0] * x_scale)
-            y1 = int(coords[1] * y_scale)
-            x2 = int(coords[2] * x_scale)
-            y2 = int(coords[3] * y_scale)
-            box = [
-                [x1, y1],
-                [x2, y1],
-                [x2, y2],
-                [x1, y2]
-            ]
-        else:
-            # 没有足够坐标
-            box = [[0, 0], [0, 0], [0, 0], [0, 0]]
+            rect_indices.append(len(texts))
+            rect_coords.append(coords[:4])
 
-        texts.append({
-            "text": text,
-            "box": box,
-        })
+        texts.append(text)
 
-    return texts
+    # 转换为真实像素坐标，没有足够坐标的文字保持全零框
+    boxes = np.zeros((len(texts), 4, 2), dtype=np.int32)
+
+    if quad_coords:
+        quads = np.asarray(quad_coords, dtype=np.int32)
+        boxes[quad_indices] = _scale_boxes(quads, x_scale, y_scale)
+
+    if rect_coords:
+        # 边界框展开为四个角点: (x1,y1) (x2,y1) (x2,y2) (x1,y2)
+        rects = np.asarray(rect_coords, dtype=np.int32)
+        quads = rects[:, [0, 1, 2, 1, 2, 3, 0, 3]]
+        boxes[rect_indices] = _scale_boxes(quads, x_scale, y_scale)
+
+    return texts, boxes
 
 
 def ocr_image(
@@ -119,7 +251,8 @@ def ocr_image(
     api_key: str,
     model: str = "PaddlePaddle/PaddleOCR-VL-1.5",
     prompt: str = "请识别这张图片中的所有文字。",
-    max_tokens: int = 2000
+    max_tokens: int = 2000,
+    loc_max: Optional[int] = None
 ) -> Dict[str, Any]:
     """
     调用硅基流动平台的 OCR 模型识别图片中的文字，返回结构化数据
@@ -130,26 +263,26 @@ def ocr_image(
         model: 使用的模型名称
         prompt: 识别提示词
         max_tokens: 最大返回 token 数
+        loc_max: 已知的 LOC 归一化最大值，None 表示从响应中推断
 
     Returns:
         Dict: {
             "image_path": str,
             "image_size": [width, height],
-            "texts": List[Dict],  # 文本项列表
-            "full_text": str,     # 所有文本的组合
+            "texts": List[str],       # 文字列表
+            "boxes": np.ndarray,      # (N, 4, 2) 像素坐标，与 texts 一一对应
         }
-    """
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.siliconflow.cn/v1"
-    )
 
-    # 获取图片尺寸
-    image_size = get_image_size(image_path)
+        需要所有文本的组合时，调用 _join_texts(result["texts"])；
+        输出 JSON 前用 _to_json_result 转换为 [{"text", "box"}, ...] 结构
+    """
+    client = _get_client(api_key, _BASE_URL)
 
-    # 转换图片为 base64
-    base64_image = image_to_base64(image_path)
-    mime_type = get_mime_type(image_path)
+    # 只读取一次文件，同时得到图片尺寸和 data URL
+    raw_image, image_size = _load_image(image_path)
+    image_url = _build_data_url(raw_image, get_mime_type(image_path))
+    # 原始字节已编码完毕，请求期间不再持有
+    del raw_image
 
     response = client.chat.completions.create(
         model=model,
@@ -161,7 +294,7 @@ def ocr_image(
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}"
+                            "url": image_url
                         }
                     }
                 ]
@@ -176,37 +309,65 @@ def ocr_image(
             "image_path": image_path,
             "image_size": list(image_size),
             "texts": [],
-            "full_text": ""
+            "boxes": np.zeros((0, 4, 2), dtype=np.int32),
         }
 
     # 解析 LOC 标记，提取文本和位置信息（包含坐标转换）
-    texts = parse_loc_tags(content, image_size)
-
-    full_text = "\n".join([t.get("text", "") for t in texts])
+    texts, boxes = parse_loc_tags(content, image_size, loc_max=loc_max)
 
     return {
         "image_path": image_path,
         "image_size": list(image_size),
         "texts": texts,
-        "full_text": full_text
+        "boxes": boxes,
+    }
+
+
+def _join_texts(texts: List[str]) -> str:
+    """将文字列表按行拼接为完整文本"""
+    return "\n".join(texts)
+
+
+def _to_json_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    将 ocr_image 的结果转换为 JSON 输出结构，texts 与 boxes 合并为 [{"text", "box"}, ...]，
+    并补充 full_text
+
+    orjson 可以直接序列化 numpy 数组；否则对整个坐标数组只调用一次 tolist()
+    """
+    if "error" in result:
+        return result
+
+    boxes = result["boxes"]
+    if orjson is None:
+        boxes = boxes.tolist()
+
+    return {
+        "image_path": result["image_path"],
+        "image_size": result["image_size"],
+        "texts": [{"text": text, "box": box} for text, box in zip(result["texts"], boxes)],
+        "full_text": _join_texts(result["texts"]),
     }
 
 
+def _dumps_json(obj: Any) -> bytes:
+    """将结果序列化为 UTF-8 编码的 JSON，已安装 orjson 时使用 orjson 加速"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
 def resolve_glob_pattern(pattern: str) -> List[str]:
     """解析 glob 模式返回文件列表"""
-    import glob
     return glob.glob(pattern)
 
 
 def get_api_key() -> Optional[str]:
     """从环境变量获取 API Key"""
-    import os
     return os.environ.get("SILICONFLOW_API_KEY")
 
 
 def main():
-    import argparse
-
     parser = argparse.ArgumentParser(
         description="OCR - 使用 PaddleOCR 识别图片中的文字",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -261,8 +422,24 @@ Use cases:
         default=2000,
         help="最大返回 token 数（默认: 2000）"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="并发请求的线程数（默认: 8）"
+    )
+    parser.add_argument(
+        "--loc-max",
+        type=int,
+        default=None,
+        help="LOC 坐标的归一化最大值（如 972）；默认根据识别结果中的最大 LOC 值推断"
+    )
 
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers 必须大于 0")
+    if args.loc_max is not None and args.loc_max < 1:
+        parser.error("--loc-max 必须大于 0")
 
     # 获取 API Key
     api_key = args.api_key or get_api_key()
@@ -273,64 +450,86 @@ Use cases:
         print("  2. 使用 -k 参数: %(prog)s -k your_key image.png" % {"prog": parser.prog}, file=sys.stderr)
         sys.exit(1)
 
-    # 解析图片列表
+    # 解析图片列表，按真实路径去重，避免重叠的 glob 模式重复请求同一张图片
     image_files: List[str] = []
+    seen_paths = set()
     for pattern in args.images:
         files = resolve_glob_pattern(pattern)
-        if files:
-            image_files.extend(files)
-        else:
+        if not files:
             # 如果 glob 没匹配到，可能是精确路径
             if Path(pattern).exists():
-                image_files.append(pattern)
+                files = [pattern]
             else:
                 print(f"警告: 未找到匹配的文件: {pattern}", file=sys.stderr)
+                continue
+
+        for image_path in files:
+            real_path = os.path.realpath(image_path)
+            if real_path not in seen_paths:
+                seen_paths.add(real_path)
+                image_files.append(image_path)
 
     if not image_files:
         print("错误: 没有找到有效的图片文件", file=sys.stderr)
         sys.exit(1)
 
-    # 处理每张图片
-    results = {}
-    for image_path in image_files:
-        if not Path(image_path).exists():
-            print(f"警告: 跳过不存在的文件: {image_path}", file=sys.stderr)
-            continue
-
-        try:
-            result = ocr_image(
+    # 并发处理所有图片: 每张图片耗时主要在网络请求上，使用线程池即可
+    # 结果只在主线程中打印，输出不会交错
+    outcomes: Dict[str, Dict[str, Any]] = {}
+    # 提前创建共享客户端，避免线程池中的首批请求各自创建
+    _get_client(api_key, _BASE_URL)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for image_path in image_files:
+            future = executor.submit(
+                ocr_image,
                 image_path,
                 api_key,
                 model=args.model,
                 prompt=args.prompt,
-                max_tokens=args.max_tokens
+                max_tokens=args.max_tokens,
+                loc_max=args.loc_max
             )
+            futures[future] = image_path
+
+        for future in as_completed(futures):
+            image_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"错误: 处理 {image_path} 时出错 - {e}", file=sys.stderr)
+                outcomes[image_path] = {"error": str(e)}
+                continue
 
-            file_name = Path(image_path).name
-            results[file_name] = result
+            outcomes[image_path] = result
 
             # 输出结果
             if args.json:
                 pass  # JSON 输出在最后统一处理
             else:
-                print(f"--- {file_name} ---")
-                print(result.get("full_text", ""))
-                if result.get("texts"):
+                print(f"--- {Path(image_path).name} ---")
+                print(_join_texts(result["texts"]))
+                if result["texts"]:
                     print(f"识别到 {len(result['texts'])} 处文字区域")
                 print()
 
-        except Exception as e:
-            print(f"错误: 处理 {image_path} 时出错 - {e}", file=sys.stderr)
-            results[Path(image_path).name] = {"error": str(e)}
-
     # JSON 输出或保存到文件
     if args.json or args.output:
+        # 按输入顺序整理结果，保证 JSON 输出稳定
+        results = {}
+        for image_path in image_files:
+            if image_path in outcomes:
+                results[Path(image_path).name] = _to_json_result(outcomes[image_path])
+
+        data = _dumps_json(results)
         if args.output:
-            with open(args.output, "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
+            with open(args.output, "wb") as f:
+                f.write(data)
             print(f"结果已保存到: {args.output}", file=sys.stderr)
         else:
-            print(json.dumps(results, ensure_ascii=False, indent=2))
+            sys.stdout.flush()
+            sys.stdout.buffer.write(data + b"\n")
+            sys.stdout.buffer.flush()
 
 
 if __name__ == "__main__":
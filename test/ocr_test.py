@@ -1,10 +1,15 @@
 import base64
+import functools
+import io
 import json
+import os
 import re
 import sys
 from pathlib import Path
 from typing import Dict, Any, List, Tuple
+import numpy as np
 from openai import OpenAI
+from PIL import Image
 
 """用法: python ocr_test.py <图片路径>
 
@@ -30,31 +35,52 @@ LOC 坐标说明:
 """
 
 
-def image_to_base64(image_path: str) -> str:
-    """将图片文件转换为 base64 字符串"""
+# 文本片段与其后紧跟的一串 <|LOC_xxx|> 标记
+_PAIR_RE = re.compile(r'([^\|<]+?)((?:<\|LOC_\d+\|\>)+)')
+# 单个 LOC 标记中的数值
+_LOC_RE = re.compile(r'LOC_(\d+)')
+
+# 文件扩展名到 MIME 类型的映射
+_MIME_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".gif": "image/gif",
+}
+
+# 硅基流动平台 API 地址
+_BASE_URL = "https://api.siliconflow.cn/v1"
+
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str, base_url: str) -> OpenAI:
+    """获取 OpenAI 客户端，相同配置复用同一个客户端及其连接池"""
+    return OpenAI(api_key=api_key, base_url=base_url)
+
+
+def _load_image(image_path: str) -> Tuple[bytes, Tuple[int, int]]:
+    """读取图片文件一次，同时返回原始字节和图片尺寸"""
     with open(image_path, "rb") as f:
-        return base64.b64encode(f.read()).decode("utf-8")
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as img:
+        return data, img.size
 
 
-def get_image_size(image_path: str) -> Tuple[int, int]:
-    """获取图片尺寸"""
-    from PIL import Image
-    with Image.open(image_path) as img:
-        return img.size
+def _build_data_url(raw: bytes, mime_type: str) -> str:
+    """将图片字节直接编码为 data URL，避免中间字符串拼接产生的额外拷贝"""
+    buf = bytearray(b"data:")
+    buf += mime_type.encode("ascii")
+    buf += b";base64,"
+    buf += base64.b64encode(raw)
+    return buf.decode("ascii")
 
 
 def get_mime_type(image_path: str) -> str:
     """根据文件扩展名获取 MIME 类型"""
-    ext = Path(image_path).suffix.lower()
-    mime_types = {
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".png": "image/png",
-        ".webp": "image/webp",
-        ".bmp": "image/bmp",
-        ".gif": "image/gif",
-    }
-    return mime_types.get(ext, "image/jpeg")
+    ext = os.path.splitext(image_path)[1].lower()
+    return _MIME_TYPES.get(ext, "image/jpeg")
 
 
 def parse_loc_tags(content: str, image_size: Tuple[int, int]) -> List[Dict[str, Any]]:
@@ -68,60 +94,65 @@ def parse_loc_tags(content: str, image_size: Tuple[int, int]) -> List[Dict[str,
     """
     img_width, img_height = image_size
 
-    text_coord_pairs = re.findall(r'([^\|<]+?)((?:<\|LOC_\d+\|\>)+)', content)
+    # 单次扫描: 同时收集 (文本, LOC 数值) 并记录 LOC 最大值用于计算缩放系数
+    text_coord_pairs = []
+    max_loc = None
+    for match in _PAIR_RE.finditer(content):
+        coords = list(map(int, _LOC_RE.findall(match.group(2))))
+        if coords:
+            local_max = max(coords)
+            if max_loc is None or local_max > max_loc:
+                max_loc = local_max
+        text_coord_pairs.append((match.group(1).strip(), coords))
 
-    # 先扫描所有 LOC 值，找到最大值用于计算缩放系数
-    all_loc_values = []
-    for _, loc_tags in text_coord_pairs:
-        coords = [int(c) for c in re.findall(r'LOC_(\d+)', loc_tags)]
-        all_loc_values.extend(coords)
-
-    max_loc = max(all_loc_values) if all_loc_values else 972
+    if max_loc is None:
+        max_loc = 972
 
     # 计算缩放系数
     x_scale = img_width / max_loc if max_loc > 0 else 1
     y_scale = img_height / max_loc if max_loc > 0 else 1
 
     texts = []
+    # 按坐标数量分组收集，之后统一做向量化缩放
+    quad_indices, quad_coords = [], []
+    rect_indices, rect_coords = [], []
 
-    for text_chunk, loc_tags in text_coord_pairs:
-        text = text_chunk.strip()
+    for text, coords in text_coord_pairs:
         if not text:
             continue
 
-        # 提取 LOC 数值
-        coord_matches = re.findall(r'LOC_(\d+)', loc_tags)
-        coords = [int(c) for c in coord_matches]
-
-        # 转换为真实像素坐标
         if len(coords) >= 8:
             # 4个点(每个点2个坐标): x1,y1,x2,y2,x3,y3,x4,y4
-            box = []
-            for i in range(0, 8, 2):
-                x = int(coords[i] * x_scale)
-                y = int(coords[i+1] * y_scale)
-                box.append([x, y])
+            quad_indices.append(len(texts))
+            quad_coords.append(coords[:8])
         elif len(coords) >= 4:
             # 4个值: x1,y1,x2,y2 (边界框)
-            x1 = int(coords[0] * x_scale)
-            y1 = int(coords[1] * y_scale)
-            x2 = int(coords[2] * x_scale)
-            y2 = int(coords[3] * y_scale)
-            box = [
-                [x1, y1],
-                [x2, y1],
-                [x2, y2],
-                [x1, y2]
-            ]
-        else:
-            # 没有足够坐标
-            box = [[0, 0], [0, 0], [0, 0], [0, 0]]
+            rect_indices.append(len(texts))
+            rect_coords.append(coords[:4])
 
+        # 没有足够坐标时保持全零框
         texts.append({
             "text": text,
-            "box": box,
+            "box": [[0, 0], [0, 0], [0, 0], [0, 0]],
         })
 
+    # 转换为真实像素坐标: 每个点的 (x, y) 分别乘以 (x_scale, y_scale)
+    scale = np.array([x_scale, y_scale], dtype=np.float64)
+
+    if quad_coords:
+        points = np.asarray(quad_coords, dtype=np.int32).reshape(-1, 4, 2)
+        boxes = (points * scale).astype(np.int32).tolist()
+        for i, box in zip(quad_indices, boxes):
+            texts[i]["box"] = box
+
+    if rect_coords:
+        # 边界框展开为四个角点: (x1,y1) (x2,y1) (x2,y2) (x1,y2)
+        rects = np.asarray(rect_coords, dtype=np.int32)
+        points = rects[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+        boxes = (points * scale).astype(np.int32).tolist()
+        for i, box in zip(rect_indices, boxes):
+            texts[i]["box"] = box
+
     return texts
 
 
@@ -136,17 +167,11 @@ def ocr_image(image_path: str, api_key: str, model: str = "PaddlePaddle/PaddleOC
             "full_text": str,     # 所有文本的组合
         }
     """
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://api.siliconflow.cn/v1"
-    )
-
-    # 获取图片尺寸
-    image_size = get_image_size(image_path)
+    client = _get_client(api_key, _BASE_URL)
 
-    # 转换图片为 base64
-    base64_image = image_to_base64(image_path)
-    mime_type = get_mime_type(image_path)
+    # 只读取一次文件，同时得到图片尺寸和 data URL
+    raw_image, image_size = _load_image(image_path)
+    image_url = _build_data_url(raw_image, get_mime_type(image_path))
 
     # 使用简单的提示词，让模型返回原生格式（包含 LOC 标记）
     prompt = "请识别这张图片中的所有文字。"
@@ -161,7 +186,7 @@ def ocr_image(image_path: str, api_key: str, model: str = "PaddlePaddle/PaddleOC
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:{mime_type};base64,{base64_image}"
+                            "url": image_url
                         }
                     }
                 ]